@@ -13,6 +13,9 @@ setup(name='tap-persistiq',
           'requests==2.22.0',
           'singer-python==5.8.1'
       ],
+      extras_require={
+          'parquet': ['pyarrow==0.17.1']
+      },
       entry_points='''
           [console_scripts]
           tap-persistiq=tap_persistiq:main
@@ -6,6 +6,7 @@ import argparse
 import singer
 from singer import metadata, utils
 from tap_persistiq.client import PersistIQClient
+from tap_persistiq.daemon import Daemon, DEFAULT_INTERVAL, DEFAULT_KEEP, DEFAULT_OUTPUT_DIR
 from tap_persistiq.discover import discover
 from tap_persistiq.sync import sync
 
@@ -25,9 +26,32 @@ def do_discover():
     LOGGER.info('Finished discover')
 
 
+# Daemon options are parsed here; the remaining args are left for singer.utils.parse_args
+def parse_daemon_args():
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running, syncing every --interval seconds')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help='Seconds between daemon syncs')
+    parser.add_argument('--socket', default=None,
+                        help='Unix socket path; a connection triggers an immediate sync')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR,
+                        help='Directory for daemon output and state files')
+    parser.add_argument('--keep', type=int, default=DEFAULT_KEEP,
+                        help='Number of daemon output and state files to retain')
+    daemon_args, remaining_args = parser.parse_known_args()
+    if daemon_args.keep < 1:
+        parser.error('--keep must be at least 1')
+    if daemon_args.interval <= 0:
+        parser.error('--interval must be greater than 0')
+    sys.argv = sys.argv[:1] + remaining_args
+    return daemon_args
+
+
 @singer.utils.handle_top_exception(LOGGER)
 def main():
 
+    daemon_args = parse_daemon_args()
     parsed_args = singer.utils.parse_args(REQUIRED_CONFIG_KEYS)
 
     with PersistIQClient(parsed_args.config['access_token'],
@@ -39,6 +63,15 @@ def main():
 
         if parsed_args.discover:
             do_discover()
+        elif parsed_args.catalog and daemon_args.daemon:
+            Daemon(client=client,
+                   config=parsed_args.config,
+                   catalog=parsed_args.catalog,
+                   state=state,
+                   output_dir=daemon_args.output_dir,
+                   interval=daemon_args.interval,
+                   socket_path=daemon_args.socket,
+                   keep=daemon_args.keep).run()
         elif parsed_args.catalog:
             sync(client=client,
                  config=parsed_args.config,
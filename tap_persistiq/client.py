@@ -120,6 +120,8 @@ class PersistIQClient(object):
             # Simple endpoint that returns 1 Account record (to check API/access_token access):
             url='{}/{}'.format(self.base_url, 'users'),
             headers=headers)
+        if response.status_code == 429:
+            raise Server429Error()
         if response.status_code != 200:
             LOGGER.error('Error status_code = {}'.format(response.status_code))
             raise_for_error(response)
@@ -167,6 +169,10 @@ class PersistIQClient(object):
         if response.status_code >= 500:
             raise Server5xxError()
 
+        # Rate limited (likely with concurrent backfill windows): retried by backoff
+        if response.status_code == 429:
+            raise Server429Error()
+
         if response.status_code != 200:
             raise_for_error(response)
 
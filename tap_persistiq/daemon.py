@@ -0,0 +1,173 @@
+import os
+import glob
+import json
+import shutil
+import stat
+import time
+import select
+import signal
+import socket
+import contextlib
+from datetime import datetime
+import singer
+from tap_persistiq.sink import get_run_dirs, RUN_ID_FORMAT, \
+    DEFAULT_OUTPUT_DIR as DEFAULT_SINK_OUTPUT_DIR
+from tap_persistiq.streams import STREAMS
+from tap_persistiq.sync import sync
+
+LOGGER = singer.get_logger()
+
+DEFAULT_INTERVAL = 900
+DEFAULT_KEEP = 10
+DEFAULT_OUTPUT_DIR = 'daemon'
+
+
+# Runs sync on a schedule with one verified client and catalog kept in memory.
+# Each run's stdout is written to output-<run_id>.jsonl and its state to
+#   state-<run_id>.json and state.json in output_dir, keeping the last `keep` runs
+#   (and the last `keep` sink run folders per stream in file output modes).
+# Connecting to socket_path (if set) triggers an immediate run.
+class Daemon(object):
+
+    def __init__(self,
+                 client,
+                 config,
+                 catalog,
+                 state,
+                 output_dir=DEFAULT_OUTPUT_DIR,
+                 interval=DEFAULT_INTERVAL,
+                 socket_path=None,
+                 keep=DEFAULT_KEEP):
+        self.client = client
+        self.config = config
+        self.catalog = catalog
+        self.state = state
+        self.output_dir = output_dir
+        self.interval = interval
+        self.socket_path = socket_path
+        self.keep = keep
+        self.stopping = False
+
+    # SIGTERM during a run stops the daemon once the run finishes; a second SIGTERM
+    #   interrupts the run. SIGINT (Ctrl-C) interrupts a run right away.
+    def stop(self, signum, frame):
+        if self.stopping:
+            raise KeyboardInterrupt
+        LOGGER.info('Daemon received signal {}, stopping after current run'.format(signum))
+        self.stopping = True
+
+    def open_socket(self):
+        if not self.socket_path:
+            return None
+        # Only replace a stale socket: never another file or a live daemon's socket
+        if os.path.exists(self.socket_path):
+            if not stat.S_ISSOCK(os.stat(self.socket_path).st_mode):
+                raise Exception('Error: --socket path exists and is not a socket: {}'.format(
+                    self.socket_path))
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                client.connect(self.socket_path)
+            except ConnectionRefusedError:
+                os.unlink(self.socket_path)
+            else:
+                raise Exception('Error: a daemon is already listening on: {}'.format(
+                    self.socket_path))
+            finally:
+                client.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(1)
+        LOGGER.info('Daemon listening for triggers on: {}'.format(self.socket_path))
+        return listener
+
+    def close_socket(self, listener):
+        if listener is None:
+            return
+        listener.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    # Wait for the next scheduled run, a socket trigger or a stop signal
+    def wait(self, listener):
+        previous_handler = signal.signal(signal.SIGINT, self.stop)
+        try:
+            self.wait_for_trigger(listener)
+        finally:
+            signal.signal(signal.SIGINT, previous_handler)
+
+    def wait_for_trigger(self, listener):
+        deadline = time.time() + self.interval
+        while not self.stopping:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            timeout = min(remaining, 1)
+            if listener is None:
+                time.sleep(timeout)
+                continue
+            readable, _, _ = select.select([listener], [], [], timeout)
+            if readable:
+                connection, _ = listener.accept()
+                connection.sendall(b'ok\n')
+                connection.close()
+                LOGGER.info('Daemon triggered over socket')
+                return
+
+    def write_state(self, run_id):
+        state_json = json.dumps(self.state)
+        for file_name in ['state-{}.json'.format(run_id), 'state.json']:
+            state_path = os.path.join(self.output_dir, file_name)
+            with open(state_path + '.tmp', 'w') as file:
+                file.write(state_json)
+            os.replace(state_path + '.tmp', state_path)
+
+    def rotate(self, pattern):
+        run_files = sorted(glob.glob(os.path.join(self.output_dir, pattern)))
+        for file_path in run_files[:-self.keep]:
+            os.remove(file_path)
+
+    # File output modes (output_format) write a run folder per stream on every run
+    def rotate_sink_runs(self):
+        if self.config.get('output_format', 'singer') == 'singer':
+            return
+        sink_output_dir = self.config.get('output_dir', DEFAULT_SINK_OUTPUT_DIR)
+        for stream_name in STREAMS:
+            for run_dir in get_run_dirs(sink_output_dir, stream_name)[:-self.keep]:
+                shutil.rmtree(run_dir)
+
+    def run_sync(self):
+        run_id = datetime.utcnow().strftime(RUN_ID_FORMAT)
+        output_path = os.path.join(self.output_dir, 'output-{}.jsonl'.format(run_id))
+        LOGGER.info('Daemon starting run: {}'.format(run_id))
+        start = time.time()
+        try:
+            with open(output_path, 'w') as output, contextlib.redirect_stdout(output):
+                sync(client=self.client,
+                     config=self.config,
+                     catalog=self.catalog,
+                     state=self.state)
+        except Exception as err: #pylint: disable=broad-except
+            # Keep the daemon alive; state holds progress up to the failure
+            LOGGER.exception('Daemon run {} failed: {}'.format(run_id, err))
+        finally:
+            # Also on an interrupted run, so the next start resumes from its progress
+            self.write_state(run_id)
+            self.rotate('output-*.jsonl')
+            self.rotate('state-*.json')
+            self.rotate_sink_runs()
+        LOGGER.info('Daemon finished run: {}, seconds: {:.1f}'.format(
+            run_id, time.time() - start))
+
+    def run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        previous_handler = signal.signal(signal.SIGTERM, self.stop)
+        listener = None
+        try:
+            listener = self.open_socket()
+            while not self.stopping:
+                self.run_sync()
+                self.wait(listener)
+        finally:
+            self.close_socket(listener)
+            signal.signal(signal.SIGTERM, previous_handler)
+        LOGGER.info('Daemon stopped')
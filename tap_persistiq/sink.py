@@ -0,0 +1,214 @@
+import os
+import sys
+import gzip
+import json
+import re
+from abc import ABC, abstractmethod
+from datetime import datetime
+import singer
+from singer.utils import strptime_to_utc
+
+LOGGER = singer.get_logger()
+
+# Optional dependency: pyarrow is only required for output_format = parquet
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# output_format (config): destination for synced records
+#   singer: SCHEMA/RECORD/STATE messages on stdout (default)
+#   ndjson: gzip compressed newline-delimited JSON files per stream, under output_dir
+#   parquet: Parquet files per stream, under output_dir (falls back to ndjson without pyarrow)
+# Each run writes its files and manifest.json to output_dir/<stream>/<run_id>/.
+# In file modes only STATE and a MANIFEST message per stream are written to stdout.
+OUTPUT_FORMATS = ['singer', 'ndjson', 'parquet']
+DEFAULT_OUTPUT_DIR = 'output'
+DEFAULT_BATCH_SIZE = 50000
+RUN_ID_FORMAT = '%Y%m%dT%H%M%S%fZ'
+RUN_ID_PATTERN = re.compile(r'^\d{8}T\d{12}Z$')
+
+
+class SingerSink(object):
+    def write_schema(self, stream_name, schema, key_properties):
+        try:
+            singer.write_schema(stream_name, schema, key_properties)
+        except OSError as err:
+            LOGGER.info('OS Error writing schema for: {}'.format(stream_name))
+            raise err
+
+    def write_record(self, stream_name, record, time_extracted):
+        try:
+            singer.messages.write_record(stream_name, record, time_extracted=time_extracted)
+        except OSError as err:
+            LOGGER.info('OS Error writing record for: {}'.format(stream_name))
+            LOGGER.info('record: {}'.format(record))
+            raise err
+
+    def flush(self, stream_name):
+        pass
+
+    def close_stream(self, stream_name):
+        pass
+
+    def close(self):
+        pass
+
+
+# Run folders under output_dir/<stream>/, oldest first
+def get_run_dirs(output_dir, stream_name):
+    stream_dir = os.path.join(output_dir, stream_name)
+    if not os.path.isdir(stream_dir):
+        return []
+    return [os.path.join(stream_dir, name) for name in sorted(os.listdir(stream_dir))
+            if RUN_ID_PATTERN.match(name) and os.path.isdir(os.path.join(stream_dir, name))]
+
+
+# Buffers records per stream and writes them to batched files in output_dir
+class FileSink(ABC):
+    file_extension = None
+
+    def __init__(self, output_dir, batch_size=DEFAULT_BATCH_SIZE):
+        self.output_dir = output_dir
+        self.batch_size = int(batch_size)
+        self.run_id = datetime.utcnow().strftime(RUN_ID_FORMAT)
+        self.schemas = {}
+        self.key_properties = {}
+        self.buffers = {}
+        self.files = {}
+        self.record_counts = {}
+
+    def write_schema(self, stream_name, schema, key_properties):
+        self.schemas[stream_name] = schema
+        self.key_properties[stream_name] = key_properties
+        self.buffers[stream_name] = []
+        self.files[stream_name] = []
+        self.record_counts[stream_name] = 0
+        os.makedirs(self.get_run_dir(stream_name), exist_ok=True)
+
+    def get_run_dir(self, stream_name):
+        return os.path.join(self.output_dir, stream_name, self.run_id)
+
+    def write_record(self, stream_name, record, time_extracted):
+        buffer = self.buffers[stream_name]
+        buffer.append(record)
+        if len(buffer) >= self.batch_size:
+            self.flush(stream_name)
+
+    def flush(self, stream_name):
+        buffer = self.buffers[stream_name]
+        if not buffer:
+            return
+        file_path = os.path.join(
+            self.get_run_dir(stream_name),
+            '{}-{:05d}.{}'.format(stream_name, len(self.files[stream_name]), self.file_extension))
+        try:
+            self.write_batch(file_path, stream_name, buffer)
+        except OSError as err:
+            LOGGER.info('OS Error writing batch file for: {}'.format(stream_name))
+            raise err
+        LOGGER.info('Stream: {}, wrote {} records to {}'.format(
+            stream_name, len(buffer), file_path))
+        self.files[stream_name].append({
+            'path': file_path,
+            'record_count': len(buffer)})
+        self.record_counts[stream_name] = self.record_counts[stream_name] + len(buffer)
+        self.buffers[stream_name] = []
+
+    @abstractmethod
+    def write_batch(self, file_path, stream_name, records):
+        pass
+
+    def close_stream(self, stream_name):
+        self.flush(stream_name)
+        manifest = {
+            'type': 'MANIFEST',
+            'stream': stream_name,
+            'run_id': self.run_id,
+            'format': self.file_extension,
+            'schema': self.schemas[stream_name],
+            'key_properties': self.key_properties[stream_name],
+            'record_count': self.record_counts[stream_name],
+            'files': self.files[stream_name]
+        }
+        manifest_path = os.path.join(self.get_run_dir(stream_name), 'manifest.json')
+        with open(manifest_path, 'w') as file:
+            json.dump(manifest, file, indent=2)
+        sys.stdout.write(json.dumps(manifest) + '\n')
+        sys.stdout.flush()
+
+    def close(self):
+        for stream_name in self.buffers:
+            self.flush(stream_name)
+
+
+class NDJSONSink(FileSink):
+    file_extension = 'ndjson.gz'
+
+    def write_batch(self, file_path, stream_name, records):
+        with gzip.open(file_path, 'wt') as file:
+            for record in records:
+                file.write(json.dumps(record) + '\n')
+
+
+# JSON schema type to Arrow type; date-time strings are stored as UTC timestamps,
+#   objects and arrays as JSON strings
+def arrow_type(property_schema):
+    types = property_schema.get('type', [])
+    if not isinstance(types, list):
+        types = [types]
+    if 'string' in types and property_schema.get('format') == 'date-time':
+        return pyarrow.timestamp('us', tz='UTC')
+    if 'integer' in types:
+        return pyarrow.int64()
+    if 'number' in types:
+        return pyarrow.float64()
+    if 'boolean' in types:
+        return pyarrow.bool_()
+    return pyarrow.string()
+
+
+class ParquetSink(FileSink):
+    file_extension = 'parquet'
+
+    def __init__(self, output_dir, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(output_dir, batch_size)
+        self.arrow_schemas = {}
+
+    def write_schema(self, stream_name, schema, key_properties):
+        super().write_schema(stream_name, schema, key_properties)
+        self.arrow_schemas[stream_name] = pyarrow.schema([
+            pyarrow.field(name, arrow_type(property_schema))
+            for name, property_schema in schema.get('properties', {}).items()])
+
+    def write_batch(self, file_path, stream_name, records):
+        arrow_schema = self.arrow_schemas[stream_name]
+        columns = {}
+        for field in arrow_schema:
+            values = [record.get(field.name) for record in records]
+            if pyarrow.types.is_timestamp(field.type):
+                values = [strptime_to_utc(value) if value else None for value in values]
+            elif pyarrow.types.is_string(field.type):
+                values = [json.dumps(value) if isinstance(value, (dict, list)) else value
+                          for value in values]
+            columns[field.name] = values
+        table = pyarrow.Table.from_pydict(columns, schema=arrow_schema)
+        pyarrow.parquet.write_table(table, file_path, compression='snappy')
+
+
+def get_sink(config):
+    output_format = config.get('output_format', 'singer')
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception('Error: Invalid output_format: {}, expected one of: {}'.format(
+            output_format, OUTPUT_FORMATS))
+    if output_format == 'singer':
+        return SingerSink()
+
+    output_dir = config.get('output_dir', DEFAULT_OUTPUT_DIR)
+    batch_size = config.get('output_batch_size', DEFAULT_BATCH_SIZE)
+    if output_format == 'parquet':
+        if pyarrow is not None:
+            return ParquetSink(output_dir, batch_size)
+        LOGGER.warning('pyarrow is not installed, falling back to output_format: ndjson')
+    return NDJSONSink(output_dir, batch_size)
@@ -1,32 +1,27 @@
 import time
 import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 import singer
 from singer import metrics, metadata, Transformer, utils, UNIX_SECONDS_INTEGER_DATETIME_PARSING
 from singer.utils import strptime_to_utc
 from tap_persistiq.transform import transform_json
 from tap_persistiq.streams import STREAMS
+from tap_persistiq.sink import get_sink
 
 LOGGER = singer.get_logger()
 
+# Backfill windows narrower than this are not split, regardless of page count
+MIN_BACKFILL_WINDOW = timedelta(hours=1)
+DEFAULT_BACKFILL_MAX_WORKERS = 4
+DEFAULT_BACKFILL_MAX_PAGES = 50
 
-def write_schema(catalog, stream_name):
+
+def write_schema(catalog, stream_name, sink):
     stream = catalog.get_stream(stream_name)
     schema = stream.schema.to_dict()
-
-    try:
-        singer.write_schema(stream_name, schema, stream.key_properties)
-    except OSError as err:
-        LOGGER.info('OS Error writing schema for: {}'.format(stream_name))
-        raise err
-
-
-def write_record(stream_name, record, time_extracted):
-    try:
-        singer.messages.write_record(stream_name, record, time_extracted=time_extracted)
-    except OSError as err:
-        LOGGER.info('OS Error writing record for: {}'.format(stream_name))
-        LOGGER.info('record: {}'.format(record))
-        raise err
+    sink.write_schema(stream_name, schema, stream.key_properties)
 
 
 def get_bookmark(state, stream, default):
@@ -47,6 +42,22 @@ def write_bookmark(state, stream, value):
     singer.write_state(state)
 
 
+# Backfill progress is kept apart from bookmarks (read only by the backfill path),
+#   so FULL_TABLE streams keep their semantics in normal runs
+def get_backfill_bookmark(state, stream, default):
+    if (state is None) or ('backfill_bookmarks' not in state):
+        return default
+    return state['backfill_bookmarks'].get(stream, default)
+
+
+def write_backfill_bookmark(state, stream, value):
+    if 'backfill_bookmarks' not in state:
+        state['backfill_bookmarks'] = {}
+    state['backfill_bookmarks'][stream] = value
+    LOGGER.info('Write backfill state for stream: {}, value: {}'.format(stream, value))
+    singer.write_state(state)
+
+
 def transform_datetime(this_dttm):
     with Transformer() as transformer:
         new_dttm = transformer._transform_datetime(this_dttm)
@@ -57,6 +68,7 @@ def process_records(catalog, #pylint: disable=too-many-branches
                     stream_name,
                     records,
                     time_extracted,
+                    sink,
                     bookmark_field=None,
                     bookmark_type=None,
                     max_bookmark_value=None,
@@ -100,14 +112,260 @@ def process_records(catalog, #pylint: disable=too-many-branches
                             stream_name,
                             max_bookmark_value))
 
-                write_record(stream_name,
-                            transformed_record,
-                            time_extracted=time_extracted)
+                sink.write_record(stream_name,
+                                  transformed_record,
+                                  time_extracted=time_extracted)
                 counter.increment()
 
         return max_bookmark_value, counter.value
 
 
+def parse_page_number(next_page_string):
+    if next_page_string:
+        return next_page_string.split('=')[-1]
+    return next_page_string
+
+
+def verify_id_fields(stream_name, records, id_fields):
+    rec_count = 0
+    for record in records:
+        for key in id_fields:
+            if not record.get(key):
+                LOGGER.info('Stream: {}, Missing key {} in record: {}'.format(
+                    stream_name, key, record))
+                raise RuntimeError
+        rec_count = rec_count + 1
+    return rec_count
+
+
+# Backfill windows: split [start, end) into consecutive windows of window_days
+def get_backfill_windows(start_dttm, end_dttm, window_days):
+    windows = []
+    window_start = start_dttm
+    while window_start < end_dttm:
+        window_end = min(window_start + timedelta(days=window_days), end_dttm)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+
+# Fetch pages for one backfill window, bounded by bookmark_query_field and
+#   bookmark_query_end_field. Returns (pages, complete); pages is a list of
+#   (time_extracted, records). Fetching stops after max_pages (complete = False)
+#   if the window is wide enough to be re-split.
+def fetch_window(client,
+                 stream_name,
+                 path,
+                 static_params,
+                 data_key,
+                 bookmark_query_field,
+                 bookmark_query_end_field,
+                 window_start,
+                 window_end,
+                 max_pages=None):
+    params = {
+        'page': 1,
+        **static_params,
+        bookmark_query_field: utils.strftime(window_start),
+        bookmark_query_end_field: utils.strftime(window_end)
+    }
+    next_url = '{}/{}'.format(client.base_url, path)
+
+    pages = []
+    while params['page'] is not None:
+        if max_pages and len(pages) >= max_pages and \
+            (window_end - window_start) > MIN_BACKFILL_WINDOW:
+            return pages, False
+
+        querystring = '&'.join(['%s=%s' % (key, value) for (key, value) in params.items()])
+        data = client.get(
+            url=next_url,
+            path=path,
+            params=querystring,
+            endpoint=stream_name)
+        time_extracted = utils.now()
+        if not data:
+            break
+
+        transformed_data = transform_json(data, stream_name, data_key)
+        if not transformed_data:
+            break
+
+        pages.append((time_extracted, transformed_data))
+        params['page'] = parse_page_number(data.get('next_page', None))
+
+    return pages, True
+
+
+def get_record_id(record, id_fields):
+    return tuple(record.get(key) for key in id_fields)
+
+
+def get_page_ids(pages, id_fields):
+    page_ids = set()
+    for _, records in pages:
+        page_ids.update(get_record_id(record, id_fields) for record in records)
+    return page_ids
+
+
+# Backfill a datetime-bookmarked endpoint in windows fetched concurrently.
+# Windows are written in order; the backfill bookmark advances to the end of a window
+#   only once it and all earlier windows are written, so an interrupted backfill
+#   resumes from the first incomplete window.
+# A window over max_pages is split in halves, again and again down to
+#   MIN_BACKFILL_WINDOW: its fetched pages are written right away and their records
+#   skipped in the halves. Halves are disjoint in time, so a record returned by both
+#   halves means the end query field is not applied and the backfill stops.
+def sync_endpoint_windows(client,
+                          catalog,
+                          state,
+                          stream_name,
+                          path,
+                          static_params,
+                          sink,
+                          last_datetime,
+                          backfill,
+                          bookmark_query_field,
+                          bookmark_query_end_field,
+                          data_key=None,
+                          id_fields=None):
+    backfill_start = get_backfill_bookmark(state, stream_name, last_datetime)
+    max_workers = backfill['max_workers']
+    max_pages = backfill['max_pages']
+
+    # Pending windows in write order; at most max_workers of them have a future,
+    #   which bounds both requests in flight and buffered pages.
+    # skip_ids: records already written from an enclosing window
+    # sibling: for the earlier half of a split window, the later half
+    # earlier_ids: for a later half, records fetched by the earlier half
+    pending = deque({
+        'window': window,
+        'future': None,
+        'skip_ids': None,
+        'sibling': None,
+        'earlier_ids': None
+    } for window in get_backfill_windows(
+        strptime_to_utc(backfill_start),
+        utils.now(),
+        backfill['window_days']))
+    LOGGER.info('Stream: {}, backfill from {} in {} windows'.format(
+        stream_name, backfill_start, len(pending)))
+
+    def write_pages(pages, skip_ids=None):
+        window_records = 0
+        for time_extracted, records in pages:
+            verify_id_fields(stream_name, records, id_fields)
+            if skip_ids:
+                records = [record for record in records
+                           if get_record_id(record, id_fields) not in skip_ids]
+            _, record_count = process_records(
+                catalog=catalog,
+                stream_name=stream_name,
+                records=records,
+                time_extracted=time_extracted,
+                sink=sink)
+            window_records = window_records + record_count
+        return window_records
+
+    total_records = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def submit(entry):
+            entry['future'] = executor.submit(
+                fetch_window,
+                client=client,
+                stream_name=stream_name,
+                path=path,
+                static_params=static_params,
+                data_key=data_key,
+                bookmark_query_field=bookmark_query_field,
+                bookmark_query_end_field=bookmark_query_end_field,
+                window_start=entry['window'][0],
+                window_end=entry['window'][1],
+                max_pages=max_pages)
+
+        def cancel_pending():
+            for other in pending:
+                if other['future'] is not None:
+                    other['future'].cancel()
+
+        while pending:
+            in_flight = len([entry for entry in pending if entry['future'] is not None])
+            for entry in pending:
+                if in_flight >= max_workers:
+                    break
+                if entry['future'] is None:
+                    in_flight = in_flight + 1
+                    submit(entry)
+
+            entry = pending.popleft()
+            window_start, window_end = entry['window']
+            pages, complete = entry['future'].result()
+
+            # Compare the halves of a split window as soon as both are fetched: now if
+            #   the later half is in flight, otherwise once it is popped
+            sibling = entry['sibling']
+            earlier_ids = entry['earlier_ids']
+            later_pages = pages
+            if sibling is not None:
+                earlier_ids = get_page_ids(pages, id_fields)
+                if sibling['future'] is None:
+                    sibling['earlier_ids'] = earlier_ids
+                    earlier_ids = None
+                else:
+                    later_pages, _ = sibling['future'].result()
+            if earlier_ids and earlier_ids & get_page_ids(later_pages, id_fields):
+                cancel_pending()
+                raise Exception(
+                    'Error: Stream: {}, both halves of backfill window {} to {} returned '
+                    'the same records; {} does not appear to be applied.'.format(
+                        stream_name, window_start, window_end, bookmark_query_end_field))
+
+            # Too many pages: write the pages already fetched, then re-split the window
+            #   in halves, ahead of later windows, skipping the records written so far
+            if not complete:
+                total_records = total_records + write_pages(pages, entry['skip_ids'])
+                skip_ids = get_page_ids(pages, id_fields) | (entry['skip_ids'] or set())
+                window_mid = window_start + (window_end - window_start) / 2
+                LOGGER.info('Stream: {}, re-split window {} to {} at {}'.format(
+                    stream_name, window_start, window_end, window_mid))
+                later_half = {
+                    'window': (window_mid, window_end),
+                    'future': None,
+                    'skip_ids': skip_ids,
+                    'sibling': None,
+                    'earlier_ids': None
+                }
+                pending.appendleft(later_half)
+                pending.appendleft({
+                    'window': (window_start, window_mid),
+                    'future': None,
+                    'skip_ids': skip_ids,
+                    'sibling': later_half,
+                    'earlier_ids': None
+                })
+                continue
+
+            window_records = write_pages(pages, entry['skip_ids'])
+            total_records = total_records + window_records
+            LOGGER.info('Synced Stream: {}, window: {} to {}, pages: {}, records: {}'.format(
+                stream_name,
+                window_start,
+                window_end,
+                len(pages),
+                window_records))
+
+            # Batched file output must be on disk before the bookmark passes it
+            sink.flush(stream_name)
+            write_backfill_bookmark(state, stream_name, utils.strftime(window_end))
+
+    LOGGER.info('Synced Stream: {}, backfill total records: {}'.format(
+        stream_name,
+        total_records))
+
+    return total_records
+
+
 # Sync a specific endpoint.
 def sync_endpoint(client, #pylint: disable=too-many-branches
                   catalog,
@@ -117,6 +375,7 @@ def sync_endpoint(client, #pylint: disable=too-many-branches
                   path,
                   endpoint_config,
                   static_params,
+                  sink,
                   bookmark_query_field=None,
                   bookmark_field=None,
                   bookmark_type=None,
@@ -124,7 +383,8 @@ def sync_endpoint(client, #pylint: disable=too-many-branches
                   id_fields=None,
                   selected_streams=None,
                   parent=None,
-                  parent_id=None):
+                  parent_id=None,
+                  backfill=None):
 
     # Get the latest bookmark for the stream and set the last_integer/datetime
     last_datetime = None
@@ -139,6 +399,28 @@ def sync_endpoint(client, #pylint: disable=too-many-branches
         LOGGER.info('{}, initial max_bookmark_value {}'.format(stream_name, max_bookmark_value))
         # max_bookmark_dttm = strptime_to_utc(last_datetime)
 
+    # Backfill mode: fetch date windows concurrently, for streams given an upper-bound
+    #   query field in backfill_end_query_fields (config)
+    bookmark_query_end_field = None
+    if backfill:
+        bookmark_query_end_field = backfill['end_query_fields'].get(stream_name)
+    if backfill and bookmark_type == 'datetime' and \
+        bookmark_query_field and bookmark_query_end_field:
+        return sync_endpoint_windows(
+            client=client,
+            catalog=catalog,
+            state=state,
+            stream_name=stream_name,
+            path=path,
+            static_params=static_params,
+            sink=sink,
+            last_datetime=last_datetime,
+            backfill=backfill,
+            bookmark_query_field=bookmark_query_field,
+            bookmark_query_end_field=bookmark_query_end_field,
+            data_key=data_key,
+            id_fields=id_fields)
+
     # Pagination: loop thru all pages of data using next_page (if not None)
     page = 1
     offset = 0
@@ -202,14 +484,7 @@ def sync_endpoint(client, #pylint: disable=too-many-branches
             return total_records
 
         # Verify key id_fields are present
-        rec_count = 0
-        for record in transformed_data:
-            for key in id_fields:
-                if not record.get(key):
-                    LOGGER.info('Stream: {}, Missing key {} in record: {}'.format(
-                        stream_name, key, record))
-                    raise RuntimeError
-            rec_count = rec_count + 1
+        rec_count = verify_id_fields(stream_name, transformed_data, id_fields)
 
         # Process records and get the max_bookmark_value and record_count for the set of records
         max_bookmark_value, record_count = process_records(
@@ -217,6 +492,7 @@ def sync_endpoint(client, #pylint: disable=too-many-branches
             stream_name=stream_name,
             records=transformed_data,
             time_extracted=time_extracted,
+            sink=sink,
             bookmark_field=bookmark_field,
             bookmark_type=bookmark_type,
             max_bookmark_value=max_bookmark_value,
@@ -228,16 +504,13 @@ def sync_endpoint(client, #pylint: disable=too-many-branches
         # set total_records and next_url for pagination
         total_records = total_records + record_count
 
-        def parse_page_number(next_page_string):
-            if next_page_string:
-                return next_page_string.split('=')[-1]
-            return next_page_string
-
         next_page_query_string = data.get('next_page', None)
         params['page'] = parse_page_number(next_page_query_string)
 
         # Update the state with the max_bookmark_value
+        #   (batched file output must be on disk before the bookmark passes it)
         if bookmark_field:
+            sink.flush(stream_name)
             write_bookmark(state, stream_name, max_bookmark_value)
 
         # to_rec: to record; ending record for the batch page
@@ -260,6 +533,7 @@ def sync_endpoint(client, #pylint: disable=too-many-branches
 
     # Update the state with the max_bookmark_value for non-scrolling
     if bookmark_field:
+        sink.flush(stream_name)
         write_bookmark(state, stream_name, max_bookmark_value)
 
     return total_records
@@ -308,6 +582,20 @@ def sync(client, config, catalog, state):
     if not selected_streams:
         return
 
+    # Backfill mode (backfill_window_days in config): split date-bookmarked streams
+    #   into windows fetched concurrently
+    backfill = None
+    if config.get('backfill_window_days'):
+        backfill = {
+            'window_days': float(config['backfill_window_days']),
+            'max_workers': int(config.get('backfill_max_workers', DEFAULT_BACKFILL_MAX_WORKERS)),
+            'max_pages': int(config.get('backfill_max_pages', DEFAULT_BACKFILL_MAX_PAGES)),
+            'end_query_fields': config.get('backfill_end_query_fields', {})
+        }
+
+    # Output sink: stdout Singer messages or batched files (output_format in config)
+    sink = get_sink(config)
+
     # Loop through selected_streams
     for stream_name, endpoint_config in STREAMS.items():
         if stream_name in selected_streams:
@@ -322,7 +610,7 @@ def sync(client, config, catalog, state):
 
             bookmark_field = next(iter(endpoint_config.get('replication_keys', [])), None)
 
-            write_schema(catalog, stream_name)
+            write_schema(catalog, stream_name, sink)
 
             total_records = sync_endpoint(
                 client=client,
@@ -333,14 +621,19 @@ def sync(client, config, catalog, state):
                 path=path,
                 endpoint_config=endpoint_config,
                 static_params=endpoint_config.get('params', {}),
+                sink=sink,
                 bookmark_query_field=endpoint_config.get('bookmark_query_field', None),
                 bookmark_field=bookmark_field,
                 bookmark_type=endpoint_config.get('bookmark_type', None),
                 data_key=endpoint_config.get('data_key', stream_name),
                 id_fields=endpoint_config.get('key_properties'),
-                selected_streams=selected_streams)
+                selected_streams=selected_streams,
+                backfill=backfill)
 
+            sink.close_stream(stream_name)
             update_currently_syncing(state, None)
             LOGGER.info('FINISHED Syncing: {}, total_records: {}'.format(
                 stream_name,
                 total_records))
+
+    sink.close()
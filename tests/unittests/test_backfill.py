@@ -0,0 +1,221 @@
+import copy
+import importlib
+import random
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from urllib.parse import parse_qs
+
+# tap_persistiq.sync is shadowed by the sync function re-exported in tap_persistiq
+SYNC = importlib.import_module('tap_persistiq.sync')
+
+START_DATE = '2019-01-01T00:00:00Z'
+NOW = datetime(2019, 5, 1, tzinfo=timezone.utc)
+QUERY_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+def parse_query_datetime(value):
+    # Backfill windows send QUERY_FORMAT; the normal path sends start_date as-is
+    for query_format in [QUERY_FORMAT, '%Y-%m-%dT%H:%M:%SZ']:
+        try:
+            return datetime.strptime(value, query_format).replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    raise ValueError(value)
+
+
+class FakeClient(object):
+    base_url = 'https://api.persistiq.com/v1'
+
+    def __init__(self, leads, page_size=2, apply_end_field=True):
+        self.leads = sorted(leads, key=lambda lead: lead['updated_at'])
+        self.page_size = page_size
+        self.apply_end_field = apply_end_field
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get(self, url, path, params, endpoint):
+        with self.lock:
+            self.requests.append(params)
+        # Random latency so windows complete out of order
+        time.sleep(random.uniform(0, 0.01))
+        query = {key: values[0] for key, values in parse_qs(params).items()}
+        updated_after = parse_query_datetime(query['updated_after'])
+        leads = [lead for lead in self.leads if lead['updated_at'] >= updated_after]
+        if self.apply_end_field and 'updated_before' in query:
+            updated_before = parse_query_datetime(query['updated_before'])
+            leads = [lead for lead in leads if lead['updated_at'] < updated_before]
+        page = int(query['page'])
+        offset = (page - 1) * self.page_size
+        next_page = None
+        if offset + self.page_size < len(leads):
+            next_page = '/v1/leads?page={}'.format(page + 1)
+        return {
+            'leads': [{'id': lead['id']} for lead in leads[offset:offset + self.page_size]],
+            'next_page': next_page
+        }
+
+
+def make_leads():
+    leads = []
+    # Weekly leads across the range, plus bursts that overflow the 2019-02-12 to
+    #   2019-02-26 window (6 pages) but not its halves (3 pages each)
+    day = datetime(2019, 1, 1, tzinfo=timezone.utc)
+    while day < NOW:
+        leads.append({'id': 'sparse-{}'.format(day.date()), 'updated_at': day})
+        day = day + timedelta(days=7)
+    for burst_start in [datetime(2019, 2, 13, tzinfo=timezone.utc),
+                        datetime(2019, 2, 20, tzinfo=timezone.utc)]:
+        for i in range(5):
+            leads.append({
+                'id': 'dense-{}-{}'.format(burst_start.date(), i),
+                'updated_at': burst_start + timedelta(hours=i * 12)})
+    return leads
+
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.written_ids = []
+        self.states = []
+
+        def fake_process_records(catalog, stream_name, records, time_extracted, sink, **kwargs):
+            self.written_ids.extend(record['id'] for record in records)
+            return None, len(records)
+
+        def fake_write_state(state):
+            self.states.append(copy.deepcopy(state))
+
+        patchers = [
+            mock.patch.object(SYNC, 'process_records', side_effect=fake_process_records),
+            mock.patch.object(SYNC.singer, 'write_state', side_effect=fake_write_state),
+            mock.patch.object(SYNC.utils, 'now', return_value=NOW)
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def sync_leads(self, client, state, backfill):
+        return SYNC.sync_endpoint(
+            client=client,
+            catalog=None,
+            state=state,
+            start_date=START_DATE,
+            stream_name='leads',
+            path='leads',
+            endpoint_config=SYNC.STREAMS['leads'],
+            static_params={},
+            sink=mock.Mock(),
+            bookmark_query_field='updated_after',
+            bookmark_type='datetime',
+            data_key='leads',
+            id_fields=['id'],
+            backfill=backfill)
+
+    def get_backfill(self, **kwargs):
+        backfill = {
+            'window_days': 14,
+            'max_workers': 3,
+            'max_pages': 4,
+            'end_query_fields': {'leads': 'updated_before'}
+        }
+        backfill.update(kwargs)
+        return backfill
+
+    def test_get_backfill_windows(self):
+        start = datetime(2019, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2019, 1, 25, tzinfo=timezone.utc)
+        windows = SYNC.get_backfill_windows(start, end, 10)
+        self.assertEqual(windows, [
+            (start, datetime(2019, 1, 11, tzinfo=timezone.utc)),
+            (datetime(2019, 1, 11, tzinfo=timezone.utc), datetime(2019, 1, 21, tzinfo=timezone.utc)),
+            (datetime(2019, 1, 21, tzinfo=timezone.utc), end)])
+
+    def test_get_backfill_windows_empty_range(self):
+        start = datetime(2019, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(SYNC.get_backfill_windows(start, start, 10), [])
+
+    def test_bookmarks_merge_in_order_with_resplit(self):
+        leads = make_leads()
+        client = FakeClient(leads)
+        state = {}
+
+        total_records = self.sync_leads(client, state, self.get_backfill())
+
+        # Every lead written exactly once, in updated_at order across windows
+        self.assertEqual(total_records, len(leads))
+        self.assertEqual(sorted(self.written_ids), sorted(lead['id'] for lead in leads))
+        sparse_ids = [lead_id for lead_id in self.written_ids if lead_id.startswith('sparse')]
+        self.assertEqual(sparse_ids, sorted(sparse_ids))
+
+        # The dense window was re-split into halves
+        self.assertTrue(any('updated_before=2019-02-19' in params for params in client.requests))
+
+        # Backfill bookmarks only move forward and end at now; bookmarks are untouched
+        backfill_bookmarks = [s['backfill_bookmarks']['leads'] for s in self.states]
+        self.assertEqual(backfill_bookmarks, sorted(set(backfill_bookmarks)))
+        self.assertEqual(backfill_bookmarks[-1], NOW.strftime(QUERY_FORMAT))
+        self.assertNotIn('bookmarks', state)
+
+    def test_resumes_from_backfill_bookmark(self):
+        client = FakeClient(make_leads())
+        state = {'backfill_bookmarks': {'leads': '2019-04-20T00:00:00Z'}}
+
+        self.sync_leads(client, state, self.get_backfill())
+
+        self.assertTrue(client.requests[0].endswith(
+            'updated_after=2019-04-20T00:00:00.000000Z&updated_before=2019-05-01T00:00:00.000000Z'))
+
+    def test_raises_when_end_query_field_ignored(self):
+        client = FakeClient(make_leads(), apply_end_field=False)
+
+        with self.assertRaises(Exception) as context:
+            self.sync_leads(client, {}, self.get_backfill(window_days=110, max_pages=2))
+
+        self.assertIn('updated_before does not appear to be applied', str(context.exception))
+        # Leads come back oldest first, so the halves only overlap once a window at the
+        #   one hour floor is fetched in full: about two pages per level of splitting
+        self.assertLess(len(client.requests), 100)
+
+    def test_resplits_dense_window_more_than_once(self):
+        leads = make_leads()
+        for i in range(24):
+            leads.append({
+                'id': 'burst-{}'.format(i),
+                'updated_at': datetime(2019, 2, 13, tzinfo=timezone.utc) + timedelta(hours=i)})
+        client = FakeClient(leads)
+        state = {}
+
+        total_records = self.sync_leads(client, state, self.get_backfill())
+
+        self.assertEqual(total_records, len(leads))
+        self.assertEqual(sorted(self.written_ids), sorted(lead['id'] for lead in leads))
+
+        # Windows of a quarter of backfill_window_days or less: split at least twice
+        window_widths = []
+        for params in client.requests:
+            query = {key: values[0] for key, values in parse_qs(params).items()}
+            window_widths.append(
+                parse_query_datetime(query['updated_before']) -
+                parse_query_datetime(query['updated_after']))
+        self.assertLessEqual(min(window_widths), timedelta(days=14) / 4)
+
+        backfill_bookmarks = [s['backfill_bookmarks']['leads'] for s in self.states]
+        self.assertEqual(backfill_bookmarks, sorted(set(backfill_bookmarks)))
+        self.assertEqual(backfill_bookmarks[-1], NOW.strftime(QUERY_FORMAT))
+
+    def test_normal_sync_ignores_backfill_bookmark(self):
+        client = FakeClient(make_leads(), page_size=100)
+        state = {'backfill_bookmarks': {'leads': '2019-04-20T00:00:00Z'}}
+
+        # Backfill not enabled for leads: normal path from start_date
+        self.sync_leads(client, state, self.get_backfill(end_query_fields={}))
+
+        self.assertEqual(client.requests, ['page=1&updated_after={}'.format(START_DATE)])
+        self.assertEqual(state, {'backfill_bookmarks': {'leads': '2019-04-20T00:00:00Z'}})
+
+
+if __name__ == '__main__':
+    unittest.main()
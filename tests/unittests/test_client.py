@@ -0,0 +1,55 @@
+import unittest
+from unittest import mock
+
+from tap_persistiq.client import PersistIQClient
+
+
+def make_response(status_code, body=None):
+    response = mock.Mock(status_code=status_code, content=b'')
+    response.json.return_value = body
+    return response
+
+
+class FakeSession(object):
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append(url)
+        return self.responses.pop(0)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+
+class TestClientRateLimit(unittest.TestCase):
+
+    @mock.patch('time.sleep')
+    def test_request_retries_429(self, mock_sleep):
+        session = FakeSession([
+            make_response(429),
+            make_response(429),
+            make_response(200, {'leads': []})])
+        with mock.patch('requests.Session', return_value=session):
+            client = PersistIQClient('token', user_agent='tap-persistiq')
+        client._PersistIQClient__verified = True
+
+        self.assertEqual(client.get('leads', endpoint='leads'), {'leads': []})
+        self.assertEqual(len(session.requests), 3)
+
+    @mock.patch('time.sleep')
+    def test_check_access_token_retries_429(self, mock_sleep):
+        session = FakeSession([
+            make_response(429),
+            make_response(200, {'type': 'list'})])
+        with mock.patch('requests.Session', return_value=session):
+            client = PersistIQClient('token')
+
+        self.assertTrue(client.check_access_token())
+        self.assertEqual(len(session.requests), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import tap_persistiq
+from tap_persistiq import daemon as DAEMON
+
+
+class TestParseDaemonArgs(unittest.TestCase):
+
+    def parse(self, argv):
+        with mock.patch.object(sys, 'argv', ['tap-persistiq'] + argv):
+            daemon_args = tap_persistiq.parse_daemon_args()
+            return daemon_args, list(sys.argv)
+
+    def test_removes_only_daemon_flags(self):
+        daemon_args, argv = self.parse([
+            '--config', 'config.json', '--daemon', '--catalog', 'catalog.json',
+            '--interval', '60', '-s', 'state.json', '--socket', '/tmp/tap.sock',
+            '--output-dir', 'runs', '--keep', '3'])
+
+        self.assertEqual(argv, [
+            'tap-persistiq', '--config', 'config.json', '--catalog', 'catalog.json',
+            '-s', 'state.json'])
+        self.assertTrue(daemon_args.daemon)
+        self.assertEqual(daemon_args.interval, 60)
+        self.assertEqual(daemon_args.socket, '/tmp/tap.sock')
+        self.assertEqual(daemon_args.output_dir, 'runs')
+        self.assertEqual(daemon_args.keep, 3)
+
+    def test_defaults_without_daemon_flags(self):
+        daemon_args, argv = self.parse(['--config', 'config.json', '--discover'])
+
+        self.assertEqual(argv, ['tap-persistiq', '--config', 'config.json', '--discover'])
+        self.assertFalse(daemon_args.daemon)
+        self.assertEqual(daemon_args.interval, DAEMON.DEFAULT_INTERVAL)
+        self.assertEqual(daemon_args.keep, DAEMON.DEFAULT_KEEP)
+
+    def test_rejects_keep_below_one(self):
+        with mock.patch('sys.stderr'), self.assertRaises(SystemExit):
+            self.parse(['--daemon', '--keep', '0'])
+
+    def test_rejects_non_positive_interval(self):
+        for interval in ['0', '-5']:
+            with mock.patch('sys.stderr'), self.assertRaises(SystemExit):
+                self.parse(['--daemon', '--interval', interval])
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        # Short path: AF_UNIX socket paths are limited to about 100 characters
+        self.output_dir = tempfile.mkdtemp(dir='/tmp')
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        self.socket_path = os.path.join(self.output_dir, 'tap.sock')
+
+    def make_daemon(self, config=None, **kwargs):
+        return DAEMON.Daemon(
+            client=None,
+            config=config or {},
+            catalog=None,
+            state={},
+            output_dir=self.output_dir,
+            **kwargs)
+
+    def read_state(self):
+        with open(os.path.join(self.output_dir, 'state.json')) as file:
+            return json.load(file)
+
+    def test_rotate_keeps_last_files(self):
+        daemon = self.make_daemon(keep=2)
+        names = ['output-2019010{}T000000000000Z.jsonl'.format(i) for i in range(1, 6)]
+        for name in names:
+            open(os.path.join(self.output_dir, name), 'w').close()
+
+        daemon.rotate('output-*.jsonl')
+
+        self.assertEqual(sorted(os.listdir(self.output_dir)), names[-2:])
+
+    def test_rotate_sink_runs_keeps_last_run_dirs(self):
+        sink_output_dir = os.path.join(self.output_dir, 'sink')
+        daemon = self.make_daemon(
+            config={'output_format': 'ndjson', 'output_dir': sink_output_dir}, keep=2)
+        run_ids = ['2019010{}T000000000000Z'.format(i) for i in range(1, 5)]
+        for run_id in run_ids:
+            os.makedirs(os.path.join(sink_output_dir, 'leads', run_id))
+        os.makedirs(os.path.join(sink_output_dir, 'leads', 'other'))
+
+        daemon.rotate_sink_runs()
+
+        self.assertEqual(sorted(os.listdir(os.path.join(sink_output_dir, 'leads'))),
+                         run_ids[-2:] + ['other'])
+
+    def test_write_state_on_failed_run(self):
+        def failing_sync(client, config, catalog, state):
+            state['currently_syncing'] = 'leads'
+            raise RuntimeError('API down')
+
+        daemon = self.make_daemon()
+        with mock.patch.object(DAEMON, 'sync', side_effect=failing_sync), \
+            mock.patch.object(DAEMON.LOGGER, 'exception'):
+            daemon.run_sync()
+
+        self.assertEqual(self.read_state(), {'currently_syncing': 'leads'})
+        state_files = [name for name in os.listdir(self.output_dir)
+                       if name.startswith('state-')]
+        self.assertEqual(len(state_files), 1)
+
+    def test_write_state_on_interrupted_run(self):
+        def interrupted_sync(client, config, catalog, state):
+            state['currently_syncing'] = 'leads'
+            raise KeyboardInterrupt
+
+        daemon = self.make_daemon()
+        with mock.patch.object(DAEMON, 'sync', side_effect=interrupted_sync):
+            with self.assertRaises(KeyboardInterrupt):
+                daemon.run_sync()
+
+        self.assertEqual(self.read_state(), {'currently_syncing': 'leads'})
+
+    def test_socket_triggers_runs(self):
+        daemon = self.make_daemon(interval=60, socket_path=self.socket_path)
+        runs = []
+        replies = []
+
+        def fake_sync(client, config, catalog, state):
+            runs.append(time.time())
+            state['runs'] = len(runs)
+            sys.stdout.write('{"type": "STATE"}\n')
+            if len(runs) == 3:
+                daemon.stopping = True
+
+        def trigger():
+            for _ in range(2):
+                deadline = time.time() + 5
+                while True:
+                    try:
+                        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                        connection.connect(self.socket_path)
+                        break
+                    except (FileNotFoundError, ConnectionRefusedError):
+                        connection.close()
+                        if time.time() > deadline:
+                            return
+                        time.sleep(0.05)
+                replies.append(connection.recv(3))
+                connection.close()
+                time.sleep(0.1)
+
+        thread = threading.Thread(target=trigger, daemon=True)
+        with mock.patch.object(DAEMON, 'sync', side_effect=fake_sync):
+            thread.start()
+            daemon.run()
+        thread.join(5)
+
+        # First run on start, then one per trigger, well before the 60s interval
+        self.assertEqual(len(runs), 3)
+        self.assertEqual(replies, [b'ok\n', b'ok\n'])
+        self.assertEqual(self.read_state(), {'runs': 3})
+        outputs = [name for name in os.listdir(self.output_dir) if name.startswith('output-')]
+        self.assertEqual(len(outputs), 3)
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_open_socket_refuses_regular_file(self):
+        with open(self.socket_path, 'w') as file:
+            file.write('not a socket')
+        daemon = self.make_daemon(socket_path=self.socket_path)
+
+        with self.assertRaises(Exception) as context:
+            daemon.open_socket()
+
+        self.assertIn('not a socket', str(context.exception))
+        with open(self.socket_path) as file:
+            self.assertEqual(file.read(), 'not a socket')
+
+    def test_open_socket_refuses_live_daemon(self):
+        live = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        live.bind(self.socket_path)
+        live.listen(1)
+        self.addCleanup(live.close)
+        daemon = self.make_daemon(socket_path=self.socket_path)
+
+        with self.assertRaises(Exception) as context:
+            daemon.open_socket()
+
+        self.assertIn('already listening', str(context.exception))
+        self.assertTrue(os.path.exists(self.socket_path))
+
+    def test_open_socket_replaces_stale_socket(self):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.socket_path)
+        stale.close()
+        daemon = self.make_daemon(socket_path=self.socket_path)
+
+        listener = daemon.open_socket()
+        self.addCleanup(daemon.close_socket, listener)
+
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(self.socket_path)
+        connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import contextlib
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from tap_persistiq import sink as SINK
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': ['null', 'string']},
+        'sent_count': {'type': ['null', 'integer']},
+        'bounced': {'type': ['null', 'boolean']},
+        'data': {
+            'type': ['null', 'object'],
+            'properties': {'full_name': {'type': ['null', 'string']}}
+        },
+        'last_sent_at': {'type': ['null', 'string'], 'format': 'date-time'}
+    }
+}
+
+
+def make_records(count):
+    return [{
+        'id': 'lead-{}'.format(i),
+        'sent_count': i,
+        'bounced': i % 2 == 0,
+        'data': {'full_name': 'Lead {}'.format(i)},
+        'last_sent_at': '2019-01-0{}T00:00:00.000000Z'.format(i + 1)
+    } for i in range(count)]
+
+
+class TestFileSink(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def write_stream(self, sink, records):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            sink.write_schema('leads', SCHEMA, ['id'])
+            for record in records:
+                sink.write_record('leads', record, time_extracted=None)
+            sink.close_stream('leads')
+        return stdout.getvalue()
+
+    def read_ndjson(self, file_path):
+        with gzip.open(file_path, 'rt') as file:
+            return [json.loads(line) for line in file]
+
+    def test_batches_at_output_batch_size(self):
+        sink = SINK.NDJSONSink(self.output_dir, batch_size=2)
+        records = make_records(5)
+
+        self.write_stream(sink, records)
+
+        self.assertEqual([f['record_count'] for f in sink.files['leads']], [2, 2, 1])
+        written = []
+        for file_info in sink.files['leads']:
+            written.extend(self.read_ndjson(file_info['path']))
+        self.assertEqual(written, records)
+
+    def test_files_named_under_stream_run_id(self):
+        sink = SINK.NDJSONSink(self.output_dir, batch_size=2)
+
+        self.write_stream(sink, make_records(3))
+
+        run_dir = os.path.join(self.output_dir, 'leads', sink.run_id)
+        self.assertEqual(sorted(os.listdir(run_dir)), [
+            'leads-00000.ndjson.gz',
+            'leads-00001.ndjson.gz',
+            'manifest.json'])
+
+    def test_manifest_on_stdout_and_in_run_dir(self):
+        sink = SINK.NDJSONSink(self.output_dir, batch_size=2)
+
+        stdout = self.write_stream(sink, make_records(3))
+
+        manifest = json.loads(stdout)
+        with open(os.path.join(self.output_dir, 'leads', sink.run_id, 'manifest.json')) as file:
+            self.assertEqual(json.load(file), manifest)
+        self.assertEqual(manifest['type'], 'MANIFEST')
+        self.assertEqual(manifest['stream'], 'leads')
+        self.assertEqual(manifest['run_id'], sink.run_id)
+        self.assertEqual(manifest['format'], 'ndjson.gz')
+        self.assertEqual(manifest['schema'], SCHEMA)
+        self.assertEqual(manifest['key_properties'], ['id'])
+        self.assertEqual(manifest['record_count'], 3)
+        self.assertEqual([f['record_count'] for f in manifest['files']], [2, 1])
+
+    @unittest.skipIf(SINK.pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_round_trip(self):
+        sink = SINK.ParquetSink(self.output_dir)
+        records = make_records(3)
+
+        self.write_stream(sink, records)
+
+        table = SINK.pyarrow.parquet.read_table(sink.files['leads'][0]['path'])
+        self.assertTrue(SINK.pyarrow.types.is_timestamp(table.schema.field('last_sent_at').type))
+        self.assertEqual(table.schema.field('sent_count').type, SINK.pyarrow.int64())
+        rows = table.to_pylist()
+        self.assertEqual(rows[0]['data'], json.dumps({'full_name': 'Lead 0'}))
+        self.assertEqual(rows[0]['last_sent_at'], datetime(2019, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual([row['id'] for row in rows], ['lead-0', 'lead-1', 'lead-2'])
+        self.assertEqual([row['bounced'] for row in rows], [True, False, True])
+
+
+class TestGetSink(unittest.TestCase):
+
+    def test_default_is_singer(self):
+        self.assertIsInstance(SINK.get_sink({}), SINK.SingerSink)
+
+    def test_rejects_unknown_format(self):
+        with self.assertRaises(Exception) as context:
+            SINK.get_sink({'output_format': 'csv'})
+        self.assertIn('Invalid output_format: csv', str(context.exception))
+
+    def test_parquet_falls_back_to_ndjson_without_pyarrow(self):
+        with mock.patch.object(SINK, 'pyarrow', None):
+            sink = SINK.get_sink({'output_format': 'parquet', 'output_batch_size': 10})
+        self.assertIsInstance(sink, SINK.NDJSONSink)
+        self.assertEqual(sink.batch_size, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()